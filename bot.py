@@ -3,21 +3,19 @@ import os
 import sys
 
 from dotenv import load_dotenv
-from pymongo import MongoClient
 from telegram import Update
 from telegram.ext import CallbackContext, CommandHandler, Updater
 
+from db import SettingsCache, get_db, get_setting
+
 load_dotenv()
 
 LOGGING_LEVEL = os.getenv("LOGGING_LEVEL", logging.INFO)
-MONGO_URI = os.getenv("MONGO_URI")
 
 if os.getenv("ENVIRONMENT") == "dev":
     BOT_TOKEN = os.getenv("BOT_TOKEN_DEV")
-    MONGO_DB = os.getenv("MONGO_DB_DEV")
 else:
     BOT_TOKEN = os.getenv("BOT_TOKEN")
-    MONGO_DB = os.getenv("MONGO_DB")
 
 logging.basicConfig(
     stream=sys.stdout,
@@ -27,13 +25,14 @@ logging.basicConfig(
 )
 logger = logging.getLogger("watch-bot")
 
-db = MongoClient(MONGO_URI)[MONGO_DB]
+db = get_db()
 
 
 def disable(update: Update, context: CallbackContext) -> None:
     """Disable load watcher"""
     logger.info("disable")
     r = db.settings.update_one({"key": "status"}, {"$set": {"enabled": False}})
+    SettingsCache.invalidate("status")
     logger.info(f"Disabled watcher: {r}")
     update.message.reply_text("Load watching disabled ❌")
 
@@ -42,6 +41,7 @@ def enable(update: Update, context: CallbackContext) -> None:
     """Enable load watcher"""
     logger.info("enable")
     r = db.settings.update_one({"key": "status"}, {"$set": {"enabled": True}})
+    SettingsCache.invalidate("status")
     logger.info(f"Enabled watcher: {r}")
     update.message.reply_text("Load watching enabled ✅")
 
@@ -49,7 +49,7 @@ def enable(update: Update, context: CallbackContext) -> None:
 def status(update: Update, context: CallbackContext) -> None:
     """Get load watcher status"""
     logger.info("status")
-    status_doc = db.settings.find_one({"key": "status"})
+    status_doc = get_setting("status")
     logger.info(status_doc)
 
     status = "disabled ❌"
@@ -62,16 +62,16 @@ def status(update: Update, context: CallbackContext) -> None:
 def logic(update: Update, context: CallbackContext) -> None:
     """Get the current load matching logic"""
     logger.info("logic")
-    logic_doc = db.settings.find_one({"key": "logic"})
+    logic_doc = get_setting("logic")
     logger.info(logic_doc)
 
-    text = "Current active logic for matching new loads\n\n"
+    parts = ["Current active logic for matching new loads\n\n"]
 
     for key, value in logic_doc.items():
         if isinstance(value, list):
-            text += f"{key}: {', '.join(value)}\n"
+            parts.append(f"{key}: {', '.join(value)}\n")
 
-    update.message.reply_text(text)
+    update.message.reply_text("".join(parts))
 
 
 def updateDestinations(update: Update, context: CallbackContext) -> None:
@@ -91,6 +91,7 @@ def updateDestinations(update: Update, context: CallbackContext) -> None:
     r = db.settings.update_one(
         {"key": "logic"}, {"$set": {"destinations": new_data}}
     )
+    SettingsCache.invalidate("logic")
     logger.info(f"Destination logic updated: {r}")
     update.message.reply_text("Destination logic updated")
 
@@ -111,6 +112,7 @@ def updateConsignees(update: Update, context: CallbackContext) -> None:
     r = db.settings.update_one(
         {"key": "logic"}, {"$set": {"consignees": new_data}}
     )
+    SettingsCache.invalidate("logic")
     logger.info(f"Consignees logic updated: {r}")
     update.message.reply_text("Consignees logic updated")
 
@@ -131,6 +133,7 @@ def updateShipModes(update: Update, context: CallbackContext) -> None:
     r = db.settings.update_one(
         {"key": "logic"}, {"$set": {"ship_modes": new_data}}
     )
+    SettingsCache.invalidate("logic")
     logger.info(f"Ship modes logic updated: {r}")
     update.message.reply_text("Ship modes logic updated")
 
@@ -148,11 +151,11 @@ def help(update: Update, context: CallbackContext) -> None:
         "/updateShipModes": updateShipModes.__doc__,
     }
 
-    text = "Supported Commands\n\n"
+    parts = ["Supported Commands\n\n"]
     for cmd, descr in cmds.items():
-        text += f"{cmd} - {descr}\n"
+        parts.append(f"{cmd} - {descr}\n")
 
-    update.message.reply_text(text)
+    update.message.reply_text("".join(parts))
 
 
 updater = Updater(BOT_TOKEN)
@@ -0,0 +1,83 @@
+import math
+import os
+import time
+from functools import lru_cache
+
+from dotenv import load_dotenv
+from pymongo import MongoClient
+
+load_dotenv()
+
+MONGO_URI = os.getenv("MONGO_URI")
+
+if os.getenv("ENVIRONMENT") == "dev":
+    MONGO_DB = os.getenv("MONGO_DB_DEV")
+else:
+    MONGO_DB = os.getenv("MONGO_DB")
+
+POOL_OPTIONS = {
+    "maxPoolSize": 20,
+    "minPoolSize": 2,
+    "socketTimeoutMS": 5000,
+    "serverSelectionTimeoutMS": 3000,
+}
+
+
+class SettingsCache:
+    """
+    In-process TTL cache for settings documents
+    """
+
+    ttl = 30
+    prepare = {}
+    _docs = {}
+
+    @classmethod
+    def get(cls, key: str):
+        value, expires_at = cls._docs.get(key, (None, 0))
+        if expires_at > time.monotonic():
+            return value
+
+    @classmethod
+    def set(cls, key: str, value: dict, ttl: float = None):
+        ttl = cls.ttl if ttl is None else ttl
+        cached, expires_at = cls._docs.get(key, (None, 0))
+        if expires_at == math.inf and ttl != math.inf:
+            # a TTL read that raced the change stream is older, keep the
+            # stream's copy
+            return cached
+
+        if key in cls.prepare:
+            value = cls.prepare[key](value)
+
+        cls._docs[key] = (value, time.monotonic() + ttl)
+        return value
+
+    @classmethod
+    def invalidate(cls, key: str):
+        cls._docs.pop(key, None)
+
+    @classmethod
+    def clear(cls):
+        cls._docs.clear()
+
+
+@lru_cache(maxsize=None)
+def get_db():
+    """
+    Get the shared database, creating the pooled client on first use
+    """
+    return MongoClient(MONGO_URI, connect=False, **POOL_OPTIONS)[MONGO_DB]
+
+
+def get_setting(key: str):
+    """
+    Get a settings doc, only hitting Mongo once the cached copy expires
+    """
+    doc = SettingsCache.get(key)
+    if doc is None:
+        doc = get_db().settings.find_one({"key": key})
+        if doc:
+            doc = SettingsCache.set(key, doc)
+
+    return doc
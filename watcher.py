@@ -1,36 +1,47 @@
+import asyncio
+import hashlib
 import logging
+import math
 import os
+import pickle
 import re
 import sys
 import time
 from datetime import datetime
 
-import requests
-from bs4 import BeautifulSoup
+import ahocorasick
+import httpx
+from bson import Binary
 from dotenv import load_dotenv
-from pymongo import MongoClient
+from lxml import etree
+from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo.errors import BulkWriteError, OperationFailure, PyMongoError
 from pytz import timezone
 
+from db import MONGO_DB, MONGO_URI, POOL_OPTIONS, SettingsCache
+
 load_dotenv()
 
 LOGGING_LEVEL = os.getenv("LOGGING_LEVEL", logging.INFO)
 USERNAME = os.getenv("USERNAME")
 PASSWORD = os.getenv("PASSWORD")
-MONGO_URI = os.getenv("MONGO_URI")
 MARKET_BASE_URL = os.getenv("MARKET_BASE_URL")
 
 LOOP_SECONDS = int(os.getenv("LOOP_SECONDS", 5))
+COOKIE_CACHE_PATH = os.path.expanduser(
+    os.getenv("COOKIE_CACHE_PATH", "~/.cache/truck/cookies.pkl")
+)
 
 if os.getenv("ENVIRONMENT") == "dev":
     BOT_TOKEN = os.getenv("BOT_TOKEN_DEV")
-    MONGO_DB = os.getenv("MONGO_DB_DEV")
     CHAT_ID = os.getenv("CHAT_ID_DEV")
 else:
     BOT_TOKEN = os.getenv("BOT_TOKEN")
-    MONGO_DB = os.getenv("MONGO_DB")
     CHAT_ID = os.getenv("CHAT_ID")
 
 BOT_BASE_URL = f"https://api.telegram.org/bot{BOT_TOKEN}"
+OFFERS_URL = f"{MARKET_BASE_URL}/market/jsp/CPRespondToOffers.jsp"
+EASTERN = timezone("US/Eastern")
 
 logging.basicConfig(
     stream=sys.stdout,
@@ -40,33 +51,281 @@ logging.basicConfig(
 )
 logger = logging.getLogger("truck-load-watch")
 
-S = requests.session()
-db = MongoClient(MONGO_URI)[MONGO_DB]
+db = AsyncIOMotorClient(MONGO_URI, **POOL_OPTIONS)[MONGO_DB]
+
+S = httpx.AsyncClient(http2=True, timeout=5.0, follow_redirects=True)
+# give the accept POST longer, a timeout there loses already logged loads
+ACCEPT_TIMEOUT = httpx.Timeout(5.0, read=30.0)
+TG = httpx.AsyncClient(
+    http2=True,
+    limits=httpx.Limits(max_connections=4, max_keepalive_connections=1),
+)
 
 WEIGHT_RE = re.compile(r"(\d+) lbs")
 
+LOGIC_LISTS = ("destinations", "consignees", "ship_modes")
+OFFERS_PAGE = {}
+SESSION = {}
+SETTINGS_TASK = None
+
 
-def check_session():
+async def get_setting(key: str):
     """
-    Check that we have an authed session
+    Get a settings doc, only hitting Mongo once the cached copy expires
     """
-    cache_doc = db.cache.find_one({"key": "cookies"})
-    if not cache_doc:
-        return login()
+    doc = SettingsCache.get(key)
+    if doc is None:
+        doc = await db.settings.find_one({"key": key})
+        if doc:
+            doc = SettingsCache.set(key, doc)
+
+    return doc
+
+
+def parse_weight(weight: str) -> int:
+    """
+    Parse a "{digits} lbs" weight, falling back to the regex on odd formats
+    """
+    try:
+        return int(weight.split(" ", 1)[0])
+    except ValueError:
+        return int(WEIGHT_RE.search(weight).group(1))
+
+
+def build_automaton(words: tuple):
+    """
+    Compile lowercase substrings into an Aho-Corasick automaton
+    """
+    automaton = ahocorasick.Automaton()
+    for word in words:
+        automaton.add_word(word, word)
+
+    if len(automaton):
+        automaton.make_automaton()
+        return automaton
+
+
+def contains_any(automaton, text: str) -> bool:
+    """
+    Check if any of the automaton substrings are in the lowercased text
+    """
+    if automaton is None:
+        return False
+
+    return next(automaton.iter(text), None) is not None
+
+
+def prepare_logic(logic: dict) -> dict:
+    """
+    Lowercase and dedupe the logic lists and compile their automata
+    once, when the logic doc is loaded into the settings cache
+    """
+    logic["automata"] = {}
+    for key in LOGIC_LISTS:
+        words = tuple(dict.fromkeys(w.lower() for w in logic[key]))
+        logic[f"{key}_lc"] = words
+        logic["automata"][key] = build_automaton(words)
+
+    return logic
+
+
+SettingsCache.prepare["logic"] = prepare_logic
+
+
+class TokenBucket:
+    """
+    Token bucket rate limiter, refilling `rate` tokens per second
+    """
+
+    def __init__(self, capacity: int, rate: float):
+        self.capacity = capacity
+        self.rate = rate
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    async def acquire(self):
+        """
+        Take a token, sleeping until one is available
+        """
+        now = time.monotonic()
+        self.tokens = min(
+            self.capacity, self.tokens + (now - self.updated) * self.rate
+        )
+        self.updated = now
+
+        if self.tokens < 1:
+            wait = (1 - self.tokens) / self.rate
+            logger.info(f"Rate limit reached, waiting {wait:.1f}s")
+            await asyncio.sleep(wait)
+            self.tokens = 1
+            self.updated = time.monotonic()
+
+        self.tokens -= 1
+
+
+# Telegram allows ~20 msgs/min to a group and ~30 msgs/sec overall
+CHAT_BUCKET = TokenBucket(20, 1 / 3)
+GLOBAL_BUCKET = TokenBucket(30, 30)
+
+
+async def send_message(text: str, retries: int = 3):
+    """
+    Send a Telegram message to the configured chat
+    """
+    for attempt in range(retries):
+        await GLOBAL_BUCKET.acquire()
+        await CHAT_BUCKET.acquire()
+        r = await TG.post(
+            f"{BOT_BASE_URL}/sendMessage",
+            data={
+                "chat_id": CHAT_ID,
+                "text": text,
+                "parse_mode": "MarkdownV2",
+            },
+        )
+        logger.info(f"Send Telegram Msg: {r}")
+        if r.status_code != 429 or attempt == retries - 1:
+            break
+
+        try:
+            retry_after = r.json()["parameters"]["retry_after"]
+        except (ValueError, KeyError, TypeError):
+            retry_after = 1
+
+        logger.info(f"Telegram rate limited, retrying after {retry_after}s")
+        await asyncio.sleep(retry_after)
+
+    if not r.is_success:
+        logger.info(r.reason_phrase)
+
+
+async def ensure_indexes():
+    """
+    Create the indexes used by the watcher queries
+    """
+    await asyncio.gather(
+        db.settings.create_index("key", unique=True),
+        db.cache.create_index("key", unique=True),
+        db.loads.create_index("dsm", unique=True),
+        db.loads.create_index([("status", 1), ("dt", -1)]),
+    )
+
+
+async def watch_settings():
+    """
+    Keep the settings cache in sync from a change stream so it never
+    expires, falling back to TTL reads if change streams are unavailable
+    """
+    while True:
+        try:
+            async with db.settings.watch(
+                full_document="updateLookup"
+            ) as stream:
+                async for doc in db.settings.find():
+                    SettingsCache.set(doc["key"], doc, ttl=math.inf)
+
+                logger.info("Watching settings changes")
+                async for change in stream:
+                    doc = change.get("fullDocument")
+                    if doc:
+                        SettingsCache.set(doc["key"], doc, ttl=math.inf)
+                    else:
+                        SettingsCache.clear()
+        except OperationFailure as e:
+            # standalone servers don't support change streams
+            logger.info(f"Settings change stream unavailable: {e}")
+            return
+        except Exception as e:
+            logger.exception(f"Settings change stream error: {e}")
+        finally:
+            # entries from the stream never expire, fall back to the TTL
+            SettingsCache.clear()
+
+        await asyncio.sleep(LOOP_SECONDS)
+
+
+def session_expired(dt: datetime) -> bool:
+    """
+    Check if cached cookies are more than an hour old
+    """
+    return (datetime.utcnow() - dt).total_seconds() / 3600 > 1
+
+
+def load_local_cookies():
+    """
+    Load the cookies cached on disk, if they are still fresh
+    """
+    try:
+        with open(COOKIE_CACHE_PATH, "rb") as f:
+            cookies, dt = pickle.load(f)
+
+        if not session_expired(dt):
+            return cookies, dt
+    except FileNotFoundError:
+        return None
+    except Exception as e:
+        logger.info(f"Discarding unreadable local cookies: {e}")
+        clear_local_cookies()
+
+
+def save_local_cookies(cookies: list, dt: datetime):
+    """
+    Cache the cookies on disk, replacing the file atomically
+    """
+    try:
+        os.makedirs(os.path.dirname(COOKIE_CACHE_PATH), exist_ok=True)
+        tmp_path = f"{COOKIE_CACHE_PATH}.tmp"
+        with open(tmp_path, "wb") as f:
+            pickle.dump((cookies, dt), f)
+
+        os.replace(tmp_path, COOKIE_CACHE_PATH)
+    except OSError as e:
+        logger.info(f"Failed to cache cookies locally: {e}")
+
+
+def clear_local_cookies():
+    """
+    Remove the cookies cached on disk
+    """
+    try:
+        os.remove(COOKIE_CACHE_PATH)
+    except FileNotFoundError:
+        pass
+    except OSError as e:
+        logger.info(f"Failed to remove local cookies: {e}")
 
-    if (datetime.utcnow() - cache_doc["dt"]).total_seconds() / 3600 > 1:
-        login()
-    else:
-        if not S.cookies.get_dict():
-            S.cookies.update(cache_doc["cookies"])
 
+async def check_session():
+    """
+    Check that we have an authed session, trying the local cookie cache
+    before the Mongo one on a cold start or once the session expires
+    """
+    if S.cookies and "dt" in SESSION and not session_expired(SESSION["dt"]):
+        return
+
+    cached = load_local_cookies()
+    if cached is None:
+        cache_doc = await db.cache.find_one({"key": "cookies"})
+        if not cache_doc or not isinstance(cache_doc["cookies"], bytes):
+            return await login()
+
+        if session_expired(cache_doc["dt"]):
+            return await login()
+
+        cached = pickle.loads(cache_doc["cookies"]), cache_doc["dt"]
+        save_local_cookies(*cached)
 
-def login():
+    cookies, SESSION["dt"] = cached
+    for cookie in cookies:
+        S.cookies.jar.set_cookie(cookie)
+
+
+async def login():
     """
     Login for a new session
     """
     logger.info("Getting new session")
-    r = S.post(
+    r = await S.post(
         f"{MARKET_BASE_URL}/core/jsp/CPLogin.jsp",
         data={
             "loginId": USERNAME,
@@ -76,17 +335,19 @@ def login():
             "submit.y": 13,
             "locale": "lo_DF",
         },
-        allow_redirects=True,
     )
     logger.info(f"Login: {r}")
 
-    r = db.cache.update_one(
+    cookies = list(S.cookies.jar)
+    dt = SESSION["dt"] = datetime.utcnow()
+    save_local_cookies(cookies, dt)
+    r = await db.cache.update_one(
         {"key": "cookies"},
         {
             "$set": {
                 "key": "cookies",
-                "cookies": S.cookies.get_dict(),
-                "dt": datetime.utcnow(),
+                "cookies": Binary(pickle.dumps(cookies)),
+                "dt": dt,
             }
         },
         upsert=True,
@@ -94,7 +355,7 @@ def login():
     logger.info(f"Cached cookies: {r}")
 
 
-def accept_load(accept_data: dict):
+async def accept_load(accept_data: dict):
     """
     Accept new load
 
@@ -113,211 +374,302 @@ def accept_load(accept_data: dict):
     }
     """
     logger.info("Accepting new load")
-    r = S.post(
-        f"{MARKET_BASE_URL}/market/jsp/CPRespondToOffers.jsp",
-        data={
-            **accept_data,
-            "postedByUserId": None,
-            "biddingLocationId": 227871,
-            "submit.x": 30,
-            "submit.y": 13,
-        },
+    accept_data.update(
+        {"biddingLocationId": 227871, "submit.x": 30, "submit.y": 13}
     )
+    # empty fields are left out, httpx would send None as an empty string
+    accept_data.pop("postedByUserId", None)
+    r = await S.post(OFFERS_URL, data=accept_data, timeout=ACCEPT_TIMEOUT)
     logger.info(f"Accept Load: {r}")
-    if not r.ok:
-        return logger.info(r.reason)
+    if not r.is_success:
+        return logger.info(r.reason_phrase)
 
 
-def check_accepted_load_threshold():
+async def check_accepted_load_threshold():
     """
     Check the number of accepted loads for today
     """
-    threshold = db.settings.find_one({"key": "load-threshold"})
     today = datetime.combine(datetime.utcnow(), datetime.min.time())
-    accepted_loads = list(
-        db.loads.find({"status": "accept", "dt": {"$gte": today}})
+    threshold, accepted_loads_cnt = await asyncio.gather(
+        get_setting("load-threshold"),
+        db.loads.count_documents({"status": "accept", "dt": {"$gte": today}}),
     )
-    accepted_loads_cnt = len(accepted_loads)
     logger.info(f"Accepted load count: {accepted_loads_cnt}")
 
     return threshold["threshold"] - accepted_loads_cnt
 
 
-def check_loads():
+def offers_headers(state: tuple) -> dict:
+    """
+    Conditional GET headers for the offers page, only sent when the logic
+    and load threshold are the same as on the last fetch
+    """
+    headers = {}
+    if OFFERS_PAGE.get("state") == state:
+        if OFFERS_PAGE.get("etag"):
+            headers["If-None-Match"] = OFFERS_PAGE["etag"]
+        if OFFERS_PAGE.get("last_modified"):
+            headers["If-Modified-Since"] = OFFERS_PAGE["last_modified"]
+
+    return headers
+
+
+def offers_changed(r: httpx.Response, state: tuple, digest: bytes) -> bool:
+    """
+    Check if the offers page needs processing, falling back to a content
+    hash when the server doesn't send validators
+    """
+    changed = (
+        OFFERS_PAGE.get("state") != state
+        or OFFERS_PAGE.get("digest") != digest
+    )
+    OFFERS_PAGE.update(
+        {
+            "etag": r.headers.get("ETag"),
+            "last_modified": r.headers.get("Last-Modified"),
+            "digest": digest,
+            "state": state,
+        }
+    )
+
+    return changed
+
+
+def parse_input(input_el, accept_data: dict):
+    """
+    Add a form input to the accept payload
+    """
+    if next(input_el.iterancestors("form"), None) is None:
+        return
+
+    name = input_el.get("name")
+    value = input_el.get("value")
+    if value is None:
+        accept_data.pop(name, None)
+        return
+
+    if value == "true":
+        value = True
+    elif value == "false":
+        value = False
+
+    accept_data[name] = value
+
+
+def parse_row(tr) -> list:
+    """
+    Get the data cells of an offers table row
+    """
+    data_row = []
+    for td in tr.xpath('./td[contains(@class, "data")]'):
+        data_input = td.find(".//input")
+        if data_input is not None and data_input.get("value") == "accept":
+            data_row.append(data_input.get("name"))
+            continue
+
+        text = " ".join("".join(td.itertext()).replace("\n", "").split())
+        if text:
+            data_row.append(text)
+
+    # nested rows are still needed for the text of their outer row
+    if next(tr.iterancestors("tr"), None) is None:
+        tr.clear(keep_tail=True)
+
+    return data_row
+
+
+async def parse_offers(r: httpx.Response):
+    """
+    Stream the offers page through an incremental parser, handling form
+    inputs and table rows as they complete and discarding the rest
+    """
+    parser = etree.HTMLPullParser(events=("end",), tag=("input", "tr"))
+    digest = hashlib.blake2b()
+    accept_data = {}
+    data = []
+
+    def read_events():
+        for _, el in parser.read_events():
+            if el.tag == "input":
+                parse_input(el, accept_data)
+            else:
+                data_row = parse_row(el)
+                if data_row:
+                    data.append(data_row)
+
+    async for chunk in r.aiter_bytes(8192):
+        digest.update(chunk)
+        parser.feed(chunk)
+        read_events()
+
+    try:
+        parser.close()
+    except etree.XMLSyntaxError as e:
+        # an empty or truncated page has no rows to read
+        logger.info(f"Offers page parse error: {e}")
+
+    read_events()
+
+    return accept_data, data, digest.digest()
+
+
+async def find_seen_dsms(dsms: list) -> set:
+    """
+    Get the dsms that have already been logged
+    """
+    cursor = db.loads.find({"dsm": {"$in": dsms}}, {"dsm": 1})
+    return {d["dsm"] async for d in cursor}
+
+
+async def check_loads():
     """
     Truck Load Watcher
     """
-    now_time = datetime.now(tz=timezone("US/Eastern")).time()
-    if now_time.hour < 6 or now_time.hour > 18:
-        logger.info(f"Current hour {now_time.hour} outside of 6 to 18")
+    hour = datetime.now(EASTERN).hour
+    if hour < 6 or hour > 18:
+        logger.info(f"Current hour {hour} outside of 6 to 18")
         return "Outside of hours"
 
-    status_doc = db.settings.find_one({"key": "status"})
+    status_doc = await get_setting("status")
     if status_doc:
         if not status_doc.get("enabled"):
             logger.info("disabled")
             return "Disabled"
     else:
-        r = db.settings.insert_one({"key": "status", "enabled": True})
+        r = await db.settings.insert_one({"key": "status", "enabled": True})
+        SettingsCache.invalidate("status")
         logger.info("No status doc found: Enabling")
 
-    remaining_loads = check_accepted_load_threshold()
+    remaining_loads, logic = await asyncio.gather(
+        check_accepted_load_threshold(), get_setting("logic")
+    )
     if remaining_loads <= 0:
         logger.info("load threshold already met")
         return "Done"
 
-    check_session()
-    r = S.get(f"{MARKET_BASE_URL}/market/jsp/CPRespondToOffers.jsp")
-    logger.info(f"Fetch Offers: {r}")
-    if not r.ok:
-        return logger.info(r.reason)
+    state = (remaining_loads, *(logic[f"{k}_lc"] for k in LOGIC_LISTS))
 
-    soup = BeautifulSoup(r.content, "html.parser")
-    elems = soup.find_all("tr")
-    form_elems = soup.find_all("form")
+    await check_session()
+    headers = offers_headers(state)
+    async with S.stream("GET", OFFERS_URL, headers=headers) as r:
+        logger.info(f"Fetch Offers: {r}")
+        if r.status_code == 304:
+            logger.info("Offers not modified")
+            return "Unchanged"
+        if r.status_code == 401:
+            logger.info("Session rejected, logging in again")
+            clear_local_cookies()
+            return await login()
+        if not r.is_success:
+            return logger.info(r.reason_phrase)
 
-    accept_data = {}
-    for form in form_elems:
-        input_els = form.find_all("input")
-        for input_el in input_els:
-            name = input_el.get("name")
-            value = input_el.get("value")
-            if value == "true":
-                value = True
-            elif value == "false":
-                value = False
-
-            accept_data[name] = value
+        accept_data, data, digest = await parse_offers(r)
 
-    data = []
-    for tr in elems:
-        data_row = []
-        for e in tr.children:
-            if hasattr(e, "attrs"):
-                e_class = e.attrs.get("class")
-                if e_class:
-                    if any("data" in c for c in e_class):
-                        data_input = e.find_all("input")
-                        action_id = None
-                        if data_input:
-                            name = data_input[0].get("name")
-                            value = data_input[0].get("value")
-                            if value == "accept":
-                                action_id = name
-
-                        if action_id:
-                            data_row.append(action_id)
-                        else:
-                            text = e.get_text().strip().replace("\n", "")
-                            text = " ".join(
-                                [t.strip() for t in text.split() if t.strip()]
-                            )
-                            if text:
-                                data_row.append(text)
-
-        if data_row:
-            data.append(data_row)
-            data_row = []
+    if not offers_changed(r, state, digest):
+        logger.info("Offers unchanged")
+        return "Unchanged"
 
     if data:
         for entry in data:
-            weight_res = re.search(WEIGHT_RE, entry[5])
-            weight = int(weight_res.group(1))
-            entry[5] = weight
+            entry[5] = parse_weight(entry[5])
 
         data = sorted(data, key=lambda x: x[5])
 
-        logic = db.settings.find_one({"key": "logic"})
+        dsms = [int(entry[0]) for entry in data]
+        seen = await find_seen_dsms(dsms)
+        matchers = logic["automata"]
 
-        text = "Hey 👋 I just accepted these loads for ya 😃\n\n"
+        parts = ["Hey 👋 I just accepted these loads for ya 😃\n\n"]
         new_loads = 0
         action_ids = []
+        new_docs = []
         for entry in data:
             dsm = int(entry[0])
-            if not db.loads.find_one({"dsm": dsm}):
-                origin = entry[1].split(" P:")
-                dest = entry[2].split(" D:")
-
-                weight = entry[5]
-                origin_loc = origin[0]
-                origin_dt = origin[1]
-                dest_loc = dest[0]
-                dest_dt = dest[1]
-                consignee = entry[4]
-                exc_ship_mode = entry[6]
-                action_id = entry[8]
-
-                if (
-                    any(
-                        d.lower() in dest_loc.lower()
-                        for d in logic["destinations"]
-                    )
-                    and any(
-                        c.lower() in consignee.lower()
-                        for c in logic["consignees"]
+            if dsm in seen:
+                continue
+
+            origin = entry[1].split(" P:")
+            dest = entry[2].split(" D:")
+
+            weight = entry[5]
+            origin_loc = origin[0]
+            origin_dt = origin[1]
+            dest_loc = dest[0]
+            dest_dt = dest[1]
+            consignee = entry[4]
+            exc_ship_mode = entry[6]
+            action_id = entry[8]
+
+            if (
+                contains_any(matchers["destinations"], dest_loc.lower())
+                and contains_any(matchers["consignees"], consignee.lower())
+                and contains_any(matchers["ship_modes"], exc_ship_mode.lower())
+            ):
+                logger.info("Current logic matched")
+
+                if new_loads < remaining_loads:
+                    logger.info("Under load threshold, taking new load")
+                    new_loads += 1
+                    action_ids.append(action_id)
+                    seen.add(dsm)
+
+                    parts.append(
+                        f"Origin Loc: `{origin_loc}`\n"
+                        f"Origin Date: `{origin_dt}`\n"
+                        f"Dest Loc: `{dest_loc}`\n"
+                        f"Dest Date: `{dest_dt}`\n"
+                        f"Consignee: `{consignee}`\n"
+                        f"Weight: `{weight}`\n"
+                        f"Exc Ship Mode: `{exc_ship_mode}`\n\n"
                     )
-                    and any(
-                        s.lower() in exc_ship_mode.lower()
-                        for s in logic["ship_modes"]
+
+                    new_docs.append(
+                        {
+                            "dsm": dsm,
+                            "action_id": action_id,
+                            "origin_loc": origin_loc,
+                            "origin_dt": origin_dt,
+                            "dest_loc": dest_loc,
+                            "dest_dt": dest_dt,
+                            "consignee": consignee,
+                            "weight": weight,
+                            "exc_ship_mode": exc_ship_mode,
+                            "status": "accept",
+                            "dt": datetime.utcnow(),
+                        }
                     )
-                ):
-                    logger.info("Current logic matched")
-
-                    if new_loads < remaining_loads:
-                        logger.info("Under load threshold, taking new load")
-                        new_loads += 1
-                        action_ids.append(action_id)
-
-                        text += (
-                            f"Origin Loc: `{origin_loc}`\n"
-                            f"Origin Date: `{origin_dt}`\n"
-                            f"Dest Loc: `{dest_loc}`\n"
-                            f"Dest Date: `{dest_dt}`\n"
-                            f"Consignee: `{consignee}`\n"
-                            f"Weight: `{weight}`\n"
-                            f"Exc Ship Mode: `{exc_ship_mode}`\n\n"
-                        )
-
-                        r = db.loads.insert_one(
-                            {
-                                "dsm": dsm,
-                                "action_id": action_id,
-                                "origin_loc": origin_loc,
-                                "origin_dt": origin_dt,
-                                "dest_loc": dest_loc,
-                                "dest_dt": dest_dt,
-                                "consignee": consignee,
-                                "weight": weight,
-                                "exc_ship_mode": exc_ship_mode,
-                                "status": "accept",
-                                "dt": datetime.utcnow(),
-                            }
-                        )
-                        logger.info(f"New load logged: {r}")
+
+        if new_docs:
+            try:
+                r = await db.loads.insert_many(new_docs, ordered=False)
+                logger.info(f"New loads logged: {r}")
+            except BulkWriteError as e:
+                logger.info(f"Failed to log some new loads: {e.details}")
 
         if new_loads and action_ids:
-            for aid in action_ids:
-                accept_data[aid] = "accept"
-
-            accept_load(accept_data)
-
-            r = requests.post(
-                f"{MARKET_BASE_URL}/sendMessage",
-                data={
-                    "chat_id": CHAT_ID,
-                    "text": text,
-                    "parse_mode": "MarkdownV2",
-                },
-            )
-            logger.info(f"Send Telegram Msg: {r}")
-            if not r.ok:
-                logger.info(r.reason)
+            accept_data.update(dict.fromkeys(action_ids, "accept"))
+
+            await accept_load(accept_data)
+
+            await send_message("".join(parts))
         else:
             logger.info("No new loads found")
 
 
-if __name__ == "__main__":
+async def main():
+    global SETTINGS_TASK
+
+    await ensure_indexes()
+    SETTINGS_TASK = asyncio.create_task(watch_settings())
     print(f"Checking every {LOOP_SECONDS} seconds")
     while True:
-        check_loads()
-        time.sleep(LOOP_SECONDS)
+        try:
+            await check_loads()
+        except (httpx.HTTPError, PyMongoError) as e:
+            logger.exception(f"Check loads failed: {e}")
+
+        await asyncio.sleep(LOOP_SECONDS)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())